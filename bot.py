@@ -1,13 +1,14 @@
 import logging
 import os
-import tempfile
 
 import json
+import uuid
 from threading import Thread
 from datetime import datetime
 from typing import Dict, Any
 from reply import handle_group_reply
-from pathlib import Path
+from digest import stats_command, send_stats_digest, get_digest_time
+from storage import RequestStore, DATA_DIR, PENDING, wait_for_leadership, release_leadership
 
 from flask import Flask, request, abort
 
@@ -53,6 +54,9 @@ ADDRESS_LIST = [
 ]
 
 
+LEADER_LOCK_PATH = DATA_DIR / "leader.lock"
+
+
 def build_application() -> Application:
     token = os.getenv("BOT_TOKEN")
     if not token:
@@ -61,123 +65,6 @@ def build_application() -> Application:
     return Application.builder().token(token).build()
 
 
-def load_counter() -> int:
-    try:
-        with open("/data/counter.json", "r", encoding="utf-8") as f:
-            data = json.load(f)
-            return data.get("counter", 1)
-    except FileNotFoundError:
-        initial = int(os.getenv("INITIAL_COUNTER_VALUE", "1"))
-        save_counter(initial)
-        logger.info(f"[counter] counter.json was not found, used counter value from the environment: {initial}")
-        return initial
-    except json.JSONDecodeError:
-        logger.warning("[counter] reading error counter.json, counter value reset to 1")
-        return 1
-
-
-def save_counter(counter: int) -> None:
-    os.makedirs("data", exist_ok=True)
-    try:
-        with open("/data/counter.json", "w", encoding="utf-8") as f:
-            json.dump({"counter": counter}, f, ensure_ascii=False)
-        logger.info(f"[counter] counter value saved: {counter}")
-    except Exception as e:
-        logger.error(f"[counter] failed to save counter to file: {e}")
-
-
-
-
-"""
-before:
-def save_request_to_file(data: Dict[str, Any]) -> None:
-    os.makedirs("data", exist_ok=True)
-    try:
-        with open("data/requests.json", "a", encoding="utf-8") as f:
-            json.dump(data, f, ensure_ascii=False)
-            f.write("\n")
-    except Exception as e:
-        logger.error(f"Failed to save request to file: {e}")
-
-after:
-def save_request_to_file(new_request: dict) -> None:
-    path = Path("data/requests.json")
-    os.makedirs(path.parent, exist_ok=True)
-    try:
-        if path.exists():
-            with path.open("r", encoding="utf-8") as f:
-                data = json.load(f)
-        else:
-            data = []
-
-        data.append(new_request)
-
-        with path.open("w", encoding="utf-8") as f:
-            json.dump(data, f, ensure_ascii=False, indent=2)
-    except Exception as e:
-        logger.error(f"Ошибка при сохранении заявки: {e}")
-
-after:
-"""
-def save_request_to_file(new_request: dict) -> None:
-    """
-    Атомарное сохранение заявки в файл requests.json
-    
-    Args:
-        new_request: Словарь с данными заявки, содержащий:
-            - timestamp: ISO строка времени создания
-            - counter: Уникальный номер заявки
-            - user: Имя пользователя или username
-            - user_id: ID пользователя в Telegram
-            - address: Адрес из заявки
-            - text: Текст заявки
-            - phone: Телефон из заявки
-            - files: Список файлов (если есть)
-            - file_types: Типы файлов (если есть)
-            - status: Статус заявки ("open" по умолчанию)
-    """
-    path = Path("/data/requests.json")
-    
-    try:
-        # Создаем директорию если не существует
-        path.parent.mkdir(parents=True, exist_ok=True)
-        
-        # Читаем существующие данные
-        if path.exists():
-            with path.open("r", encoding="utf-8") as f:
-                data = json.load(f)
-        else:
-            data = []
-        
-        # Устанавливаем статус по умолчанию если не указан
-        if "status" not in new_request:
-            new_request["status"] = "open"
-        
-        # Добавляем новую заявку
-        data.append(new_request)
-        
-        # Атомарная запись через временный файл
-        with tempfile.NamedTemporaryFile(
-            "w", delete=False, dir=path.parent, encoding="utf-8", suffix=".tmp"
-        ) as tf:
-            json.dump(data, tf, ensure_ascii=False, indent=2)
-            temp_path = Path(tf.name)
-        
-        # Атомарная замена файла
-        temp_path.replace(path)
-        
-        logger.info(f"Заявка №{new_request.get('counter')} успешно сохранена в {path.name}")
-        
-    except (OSError, json.JSONDecodeError) as e:
-        logger.error(f"Ошибка при сохранении заявки: {e}")
-        # Удаляем временный файл если он остался
-        if 'temp_path' in locals() and temp_path.exists():
-            temp_path.unlink(missing_ok=True)
-        raise
-
-
-
-
 def build_address_keyboard() -> InlineKeyboardMarkup:
     keyboard = [[InlineKeyboardButton(addr, callback_data=f"addr_{i}")] for i, addr in enumerate(ADDRESS_LIST)]
     return InlineKeyboardMarkup(keyboard)
@@ -301,13 +188,17 @@ async def input_phone(update: Update, context: CallbackContext):
     phone = context.user_data["phone"]
     files = context.user_data.get("files", [])
 
+    # Idempotency key of the draft, repeated confirmations with it are not registered twice
+    draft_key = uuid.uuid4().hex
+    context.user_data["draft_key"] = draft_key
+
     preview = (f"Ваш объект: <b>{address}</b>.\n"
                f"Ваши контактные данные: {phone}.\n\n"
                f"Текст обращения:\n{text}\n\n"
                f"Количество вложений: <b>{len(files)}</b>.\n")
 
     buttons = [[
-        InlineKeyboardButton("Отправить", callback_data="send"),
+        InlineKeyboardButton("Отправить", callback_data=f"send:{draft_key}"),
         InlineKeyboardButton("Отмена", callback_data="cancel")
     ]]
     await update.message.reply_text(
@@ -340,24 +231,62 @@ async def new_request(update: Update, context: CallbackContext):
     return SELECT_ADDRESS
 
 
+def _repeated_confirmation_text(number: int | None) -> str:
+    if number is None:
+        return "Обращение устарело. Создайте новое обращение."
+    if number == PENDING:
+        return "Обращение уже отправляется."
+    return f"Обращение #{number} уже зарегистрировано."
+
+
+async def repeated_confirmation(update: Update, context: CallbackContext):
+    """Answers "Отправить" taps that arrive after the conversation has ended."""
+    query = update.callback_query
+    store: RequestStore = context.application.bot_data["store"]
+
+    number = store.submissions.get(query.data.partition(":")[2])
+    await query.answer(_repeated_confirmation_text(number))
+
+
 async def confirmation(update: Update, context: CallbackContext):
     query = update.callback_query
-    await query.answer()
+    store: RequestStore = context.application.bot_data["store"]
+
+    action, _, draft_key = query.data.partition(":")
 
     recipient_chat = os.getenv("GROUP_ID")
     if not recipient_chat:
+        await query.answer()
         raise RuntimeError("GROUP_ID is not set in environment variables.")
 
-    if query.data == "cancel":
+    if action == "cancel":
+        await query.answer()
         return await start(update, context)
 
+    if draft_key:
+        if draft_key != context.user_data.get("draft_key"):
+            # Preview of another draft, its key must not submit the current user_data
+            logger.info(f"Confirmation of stale draft {draft_key} ignored.")
+            await query.answer(_repeated_confirmation_text(store.submissions.get(draft_key)))
+            return None
+
+        existing = store.claim_submission(draft_key)
+        if existing is not None:
+            logger.info(f"Repeated confirmation of draft {draft_key} ignored (request #{existing}).")
+            await query.answer(_repeated_confirmation_text(existing))
+            # Keep the current state, the user may be confirming a newer draft
+            return None
+
+    await query.answer()
+
     try:
-        if 'application_counter' not in context.application.bot_data:
-            context.application.bot_data['application_counter'] = load_counter()
-        
-        counter = context.application.bot_data.get("application_counter", 1)
-        context.application.bot_data["application_counter"] = counter + 1
-        save_counter(counter + 1)
+        # Remove inline keyboard from preview message before registering the request
+        try:
+            await query.edit_message_reply_markup(reply_markup=None)
+        except:
+            pass
+
+        counter = store.allocate_counter()
         
         user = query.from_user
         address = context.user_data["address"]
@@ -386,7 +315,7 @@ async def confirmation(update: Update, context: CallbackContext):
         })
         after:
         """
-        save_request_to_file({
+        store.save_request({
             "timestamp": datetime.now().isoformat(),
             "number": counter,
             "user": user.username or user.full_name,
@@ -399,20 +328,22 @@ async def confirmation(update: Update, context: CallbackContext):
             "status": 1
         })
         
+        store.record_request(counter, user.id, address, key=draft_key or None)
+
         # Send message to recipient_chat
-        await context.bot.send_message(chat_id=recipient_chat, text=full_message, parse_mode="HTML")
+        group_message = await context.bot.send_message(chat_id=recipient_chat, text=full_message, parse_mode="HTML")
+        store.record_group_message(group_message.message_id, counter)
         
         # Send files if any
         media_docs = [InputMediaDocument(media=fid) for fid, t in zip(files, file_types) if t == "document"]
         media_photos = [InputMediaPhoto(media=fid) for fid, t in zip(files, file_types) if t == "photo"]
 
         if media_docs:
-            await context.bot.send_media_group(chat_id=recipient_chat, media=media_docs)
+            for m in await context.bot.send_media_group(chat_id=recipient_chat, media=media_docs):
+                store.record_group_message(m.message_id, counter)
         if media_photos:
-            await context.bot.send_media_group(chat_id=recipient_chat, media=media_photos)
-            
-        # Remove inline keyboard from preview message
-        await query.edit_message_reply_markup(reply_markup=None)
+            for m in await context.bot.send_media_group(chat_id=recipient_chat, media=media_photos):
+                store.record_group_message(m.message_id, counter)
         
         # Send confirmation message with success status and "New Request" button
         new_request_button = InlineKeyboardMarkup([[
@@ -428,6 +359,8 @@ async def confirmation(update: Update, context: CallbackContext):
         
     except Exception as e:
         logger.error(f"Error in confirmation handler: {e}")
+        if draft_key:
+            store.release_submission(draft_key)
         
         # Remove inline keyboard from preview message even on error
         try:
@@ -482,12 +415,22 @@ def flask_app_from_bot() -> None:
         flask_app.run(host="0.0.0.0", port=8080)
 
 
-    Thread(target=run_flask).start()
+    # Daemon thread, so it does not keep the process alive after polling stops
+    Thread(target=run_flask, daemon=True).start()
 
 
 def main():
     application = build_application()
-    application.bot_data['application_counter'] = load_counter()
+
+    store = RequestStore()
+    store.load()
+    application.bot_data['store'] = store
+
+    flask_app_from_bot()
+
+    # Only the leader polls Telegram, other instances wait on the lock as warm standby
+    leader_lock = wait_for_leadership(LEADER_LOCK_PATH)
+    store.refresh()
 
     conv_handler = ConversationHandler(
         entry_points=[
@@ -502,7 +445,7 @@ def main():
                 CallbackQueryHandler(files_continue, pattern=r"^continue_phone$")
             ],
             INPUT_PHONE: [MessageHandler(filters.TEXT & ~filters.COMMAND, input_phone)],
-            CONFIRMATION: [CallbackQueryHandler(confirmation, pattern=r"^(send|cancel)$")]
+            CONFIRMATION: [CallbackQueryHandler(confirmation, pattern=r"^(send(:\w+)?|cancel)$")]
         },
         fallbacks=[CommandHandler("cancel", cancel)],
         allow_reentry=True
@@ -511,6 +454,17 @@ def main():
     application.add_handler(conv_handler)
     application.add_handler(CommandHandler("start", start))
     application.add_handler(CallbackQueryHandler(new_request, pattern=r"^new_request$"))
+    application.add_handler(CallbackQueryHandler(repeated_confirmation, pattern=r"^send:\w+$"))
+
+    stats_filter = filters.ChatType.GROUPS
+    if GROUP_ID:
+        stats_filter &= filters.Chat(chat_id=int(GROUP_ID))
+    application.add_handler(CommandHandler("stats", stats_command, filters=stats_filter))
+
+    if application.job_queue and GROUP_ID:
+        application.job_queue.run_daily(send_stats_digest, time=get_digest_time(), chat_id=int(GROUP_ID), name="stats_digest")
+    else:
+        logger.warning("[stats] JobQueue or GROUP_ID is not available, the daily digest is disabled.")
 
 
     application.add_handler(MessageHandler(
@@ -519,8 +473,11 @@ def main():
     ))
 
 
-    flask_app_from_bot()
-    application.run_polling()
+    try:
+        application.run_polling()
+    finally:
+        # Hand over to a standby instance right away instead of on process exit
+        release_leadership(leader_lock)
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,81 @@
+import logging
+import os
+from datetime import date, datetime, time, timedelta
+from telegram import Update
+from telegram.ext import ContextTypes
+from storage import RequestStore
+
+
+logger = logging.getLogger(__name__)
+
+
+def get_digest_time() -> time:
+    value = os.getenv("STATS_DIGEST_TIME", "09:00")
+    try:
+        hour, minute = (int(part) for part in value.split(":"))
+        return time(hour, minute, tzinfo=datetime.now().astimezone().tzinfo)
+    except ValueError:
+        logger.warning(f"Incorrect STATS_DIGEST_TIME '{value}', 09:00 is used.")
+        return time(9, 0, tzinfo=datetime.now().astimezone().tzinfo)
+
+
+def _format_duration(seconds: float | None) -> str:
+    if seconds is None:
+        return "—"
+
+    minutes = int(seconds // 60)
+    if minutes < 1:
+        return "< 1 мин"
+    if minutes < 60:
+        return f"{minutes} мин"
+
+    hours, minutes = divmod(minutes, 60)
+    if hours < 24:
+        return f"{hours} ч {minutes} мин"
+
+    days, hours = divmod(hours, 24)
+    return f"{days} д {hours} ч"
+
+
+def format_stats(store: RequestStore, day: date, title: str) -> str:
+    summary = store.stats.summary(day)
+    if not summary:
+        return f"{title}\n\nДанных пока нет."
+
+    lines = [title]
+    for address, item in summary.items():
+        lines.append(
+            f"\n<b>{address}</b>\n"
+            f"Новых: {item['new']}, отвечено: {item['answered']}, открыто: {item['open']}.\n"
+            f"Медиана времени ответа за день: {_format_duration(item['median'])}."
+        )
+    return "\n".join(lines)
+
+
+async def stats_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    store: RequestStore = context.bot_data["store"]
+    store.refresh()
+
+    today = date.today()
+    try:
+        await update.effective_message.reply_text(
+            format_stats(store, today, f"\U0001F4CA Статистика обращений за {today.strftime('%d.%m.%Y')}."),
+            parse_mode="HTML"
+        )
+    except Exception as e:
+        logger.error(f"Could not send the Statistics ({e}).")
+
+
+async def send_stats_digest(context: ContextTypes.DEFAULT_TYPE) -> None:
+    store: RequestStore = context.bot_data["store"]
+    store.refresh()
+
+    yesterday = date.today() - timedelta(days=1)
+    try:
+        await context.bot.send_message(
+            chat_id=context.job.chat_id,
+            text=format_stats(store, yesterday, f"\U0001F4CA Сводка обращений за {yesterday.strftime('%d.%m.%Y')}."),
+            parse_mode="HTML"
+        )
+    except Exception as e:
+        logger.error(f"Could not send the Statistics digest ({e}).")
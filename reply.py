@@ -4,6 +4,7 @@ from pathlib import Path
 from telegram import Update, Message, Chat
 from telegram.ext import ContextTypes
 from conversation import _load_json
+from storage import RequestStore, DATA_DIR
 
 
 logger = logging.getLogger(__name__)
@@ -21,18 +22,24 @@ def get_request_number(request: str) -> int | None:
             return None
 
 
-def get_user_id(request_number: int) -> int | None:
+def get_user_id(request_number: int, store: RequestStore | None = None) -> int | None:
+    if store:
+        user_id = store.get_user_id(request_number)
+        if user_id:
+            return user_id
+
+    path = DATA_DIR / "requests.json"
     try:
-        data = _load_json(Path("/data/requests.json"))
+        data = _load_json(path)
         if not isinstance(data, list):
-            logger.error("'/data/requests.json' contains incorrect data.")
+            logger.error(f"'{path}' contains incorrect data.")
             return None
 
         for request in data:
             if request.get("number") == request_number:
                 return request.get("user_id")
 
-        logger.warning(f"Request #{request_number} was not found in the '/data/requests.json'.")
+        logger.warning(f"Request #{request_number} was not found in the '{path}'.")
     except Exception as e:
         logger.error(f"Error retrieving the User ID from Request #{request_number} ({e}).")
 
@@ -114,8 +121,12 @@ async def handle_group_reply(update: Update, context: ContextTypes.DEFAULT_TYPE)
         logger.debug("No Reply.")
         return
 
+    store: RequestStore | None = context.bot_data.get("store")
+
     request = (message.reply_to_message or message.reply_to_caption)
-    request_number = get_request_number(request.text)
+    request_number = store.get_request_number(request.message_id) if store else None
+    if not request_number:
+        request_number = get_request_number(request.text)
     if not request_number:
         logger.debug("Could not get the Request Number.")
         return
@@ -139,7 +150,7 @@ async def handle_group_reply(update: Update, context: ContextTypes.DEFAULT_TYPE)
     """
 
 
-    user_id = get_user_id(request_number)
+    user_id = get_user_id(request_number, store)
     if not user_id:
         try:
             await context.bot.send_message(
@@ -156,6 +167,11 @@ async def handle_group_reply(update: Update, context: ContextTypes.DEFAULT_TYPE)
     try:
         result = await _send_reply(message, context, request_number, user_id)
         if result:
+            if store:
+                try:
+                    store.record_reply(request_number)
+                except OSError as e:
+                    logger.error(f"Could not record the Response to the Request #{request_number} ({e}).")
             await context.bot.send_message(
                 chat_id=update.effective_chat.id,
                 text=f"Ваш ответ на обращение <code>#{request_number}</code> доставлен автору.",
@@ -0,0 +1,159 @@
+import logging
+import math
+import os
+from datetime import date, datetime, timedelta
+
+
+logger = logging.getLogger(__name__)
+
+
+STATS_RETENTION_DAYS = int(os.getenv("STATS_RETENTION_DAYS", "31"))
+
+
+class QuantileSketch:
+    """
+    Streaming quantile sketch with logarithmic buckets (DDSketch-like).
+
+    Quantiles are returned with a bounded relative error, memory depends on the
+    range of values rather than on their number.
+    """
+
+    def __init__(self, relative_accuracy: float = 0.02) -> None:
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self._log_gamma = math.log(self.gamma)
+        self.bins: dict[int, int] = {}
+        self.zero = 0
+        self.count = 0
+
+    def to_state(self) -> dict:
+        return {"gamma": self.gamma, "bins": list(self.bins.items()), "zero": self.zero, "count": self.count}
+
+    @classmethod
+    def from_state(cls, state: dict) -> "QuantileSketch":
+        sketch = cls()
+        sketch.gamma = state["gamma"]
+        sketch._log_gamma = math.log(sketch.gamma)
+        sketch.bins = {key: count for key, count in state["bins"]}
+        sketch.zero = state["zero"]
+        sketch.count = state["count"]
+        return sketch
+
+    def add(self, value: float) -> None:
+        if value <= 0:
+            self.zero += 1
+        else:
+            key = math.ceil(math.log(value) / self._log_gamma)
+            self.bins[key] = self.bins.get(key, 0) + 1
+        self.count += 1
+
+    def quantile(self, q: float) -> float | None:
+        if not self.count:
+            return None
+
+        rank = q * (self.count - 1)
+        seen = self.zero
+        if rank < seen:
+            return 0.0
+
+        for key in sorted(self.bins):
+            seen += self.bins[key]
+            if seen > rank:
+                return 2 * self.gamma ** key / (self.gamma + 1)
+        return None
+
+
+class DailyBucket:
+    """Counters of one address for one day."""
+
+    def __init__(self) -> None:
+        self.new = 0
+        self.answered = 0
+        self.response_times = QuantileSketch()
+
+    def to_state(self) -> list:
+        return [self.new, self.answered, self.response_times.to_state()]
+
+    @classmethod
+    def from_state(cls, state: list) -> "DailyBucket":
+        bucket = cls()
+        bucket.new, bucket.answered = state[0], state[1]
+        bucket.response_times = QuantileSketch.from_state(state[2])
+        return bucket
+
+
+class RequestStats:
+    """
+    Per-address aggregates updated on every saved request and delivered reply.
+
+    State:
+        - daily: address -> day -> DailyBucket, first reply delays go to the day of the reply
+        - pending: request number -> (address, creation timestamp) for unanswered requests
+        - open_count: address -> number of unanswered requests
+    """
+
+    def __init__(self) -> None:
+        self.daily: dict[str, dict[date, DailyBucket]] = {}
+        self.pending: dict[int, tuple[str, float]] = {}
+        self.open_count: dict[str, int] = {}
+
+    def to_state(self) -> dict:
+        return {
+            "daily": {
+                address: {day.isoformat(): bucket.to_state() for day, bucket in days.items()}
+                for address, days in self.daily.items()
+            },
+            "pending": [[number, address, ts] for number, (address, ts) in self.pending.items()],
+            "open_count": self.open_count
+        }
+
+    @classmethod
+    def from_state(cls, state: dict) -> "RequestStats":
+        stats = cls()
+        stats.daily = {
+            address: {date.fromisoformat(day): DailyBucket.from_state(bucket) for day, bucket in days.items()}
+            for address, days in state["daily"].items()
+        }
+        stats.pending = {number: (address, ts) for number, address, ts in state["pending"]}
+        stats.open_count = dict(state["open_count"])
+        return stats
+
+    def _bucket(self, address: str, ts: float) -> DailyBucket:
+        day = datetime.fromtimestamp(ts).date()
+        days = self.daily.setdefault(address, {})
+        if day not in days:
+            cutoff = day - timedelta(days=STATS_RETENTION_DAYS)
+            for old in [d for d in days if d < cutoff]:
+                del days[old]
+            days[day] = DailyBucket()
+        return days[day]
+
+    def on_request(self, number: int, address: str, ts: float) -> None:
+        if number in self.pending:
+            return
+        self.pending[number] = (address, ts)
+        self.open_count[address] = self.open_count.get(address, 0) + 1
+        self._bucket(address, ts).new += 1
+
+    def on_reply(self, number: int, ts: float) -> None:
+        # Only the first reply answers the request
+        entry = self.pending.pop(number, None)
+        if not entry:
+            return
+        address, created = entry
+        self.open_count[address] -= 1
+        bucket = self._bucket(address, ts)
+        bucket.answered += 1
+        bucket.response_times.add(ts - created)
+
+    def summary(self, day: date) -> dict[str, dict[str, float | int | None]]:
+        addresses = set(self.daily) | set(self.open_count)
+        result = {}
+        for address in sorted(addresses):
+            bucket = self.daily.get(address, {}).get(day) or DailyBucket()
+            result[address] = {
+                "new": bucket.new,
+                "answered": bucket.answered,
+                "open": self.open_count.get(address, 0),
+                "median": bucket.response_times.quantile(0.5)
+            }
+        return result
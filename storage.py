@@ -0,0 +1,463 @@
+import logging
+import fcntl
+import json
+import os
+import zlib
+import tempfile
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, IO, Iterator
+
+from stats import RequestStats
+
+
+logger = logging.getLogger(__name__)
+
+
+DATA_DIR = Path(os.getenv("DATA_DIR", "/data"))
+SNAPSHOT_MAGIC = b"RSMS"
+SNAPSHOT_VERSION = 5
+SNAPSHOT_EVERY = int(os.getenv("SNAPSHOT_EVERY", "100"))
+DEDUPE_TTL = int(os.getenv("DEDUPE_TTL", str(24 * 60 * 60)))
+DEDUPE_MAX_SIZE = int(os.getenv("DEDUPE_MAX_SIZE", "10000"))
+
+# Marks a submission that is being processed and has no request number yet
+PENDING = 0
+
+
+@contextmanager
+def file_lock(path: Path) -> Iterator[None]:
+    """
+    Exclusive advisory lock shared by all processes using the same data volume.
+
+    Locks are bound to the open file, so the same lock must not be taken twice
+    by one process.
+    """
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with path.open("a") as f:
+        fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+
+def wait_for_leadership(path: Path) -> IO:
+    """
+    Block until this process holds the leader lock and return the lock file.
+
+    The returned file must be kept open for as long as the process stays
+    leader and passed to release_leadership on shutdown. The OS also releases
+    the lock if the process dies, so a standby instance always takes over.
+    """
+    path.parent.mkdir(parents=True, exist_ok=True)
+    f = path.open("a+")
+    try:
+        fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        f.seek(0)
+        logger.info(f"[leader] another instance is the leader ({f.read().strip() or 'unknown'}), standing by.")
+        started = time.perf_counter()
+        fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+        logger.info(f"[leader] leader lock acquired after {time.perf_counter() - started:.1f} s of standby.")
+
+    f.seek(0)
+    f.truncate()
+    f.write(f"pid={os.getpid()} host={os.uname().nodename}\n")
+    f.flush()
+    return f
+
+
+def release_leadership(f: IO) -> None:
+    """Release the leader lock returned by wait_for_leadership."""
+    try:
+        fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+    finally:
+        f.close()
+    logger.info("[leader] leader lock released.")
+
+
+class DedupeCache:
+    """
+    Bounded mapping of draft key -> request number with TTL eviction.
+
+    Entries are added in time order, so the oldest ones are always at the front.
+    Pending reservations are not persisted.
+    """
+
+    def __init__(self, ttl: int = DEDUPE_TTL, max_size: int = DEDUPE_MAX_SIZE) -> None:
+        self.ttl = ttl
+        self.max_size = max_size
+        self._items: OrderedDict[str, tuple[int, float]] = OrderedDict()
+
+    def to_state(self) -> list:
+        # Limits are configuration, so only the entries go to the snapshot
+        return [[key, number, expires] for key, (number, expires) in self._items.items() if number != PENDING]
+
+    @classmethod
+    def from_state(cls, state: list) -> "DedupeCache":
+        cache = cls()
+        cache._items = OrderedDict((key, (number, expires)) for key, number, expires in state)
+        return cache
+
+    def _evict(self, now: float) -> None:
+        while self._items:
+            _, expires = next(iter(self._items.values()))
+            if expires > now and len(self._items) <= self.max_size:
+                break
+            self._items.popitem(last=False)
+
+    def get(self, key: str) -> int | None:
+        now = time.time()
+        self._evict(now)
+        entry = self._items.get(key)
+        return entry[0] if entry and entry[1] > now else None
+
+    def put(self, key: str, number: int, ts: float) -> None:
+        self._items.pop(key, None)
+        self._items[key] = (number, ts + self.ttl)
+        self._evict(time.time())
+
+    def discard(self, key: str) -> None:
+        self._items.pop(key, None)
+
+
+class RequestStore:
+    """
+    Derived state of the bot kept in memory and persisted as a compact binary
+    snapshot plus an append-only journal of the events written after it. The
+    snapshot is a header (magic and version) followed by zlib-compressed JSON
+    of plain builtins, so loading it never runs code or imports classes.
+
+    On startup the snapshot is loaded and only the journal tail is replayed, so
+    boot time does not depend on the size of requests.json. Journal appends are
+    serialized with a file lock and first replay records written by other
+    processes, so several instances can share one data directory.
+
+    State:
+        - counter: next free request number
+        - requests: request number -> (user_id, status)
+        - group_messages: group message_id -> request number
+        - stats: per-address aggregates, see RequestStats
+        - submissions: recent draft keys -> request number, see DedupeCache
+    """
+
+    def __init__(self, data_dir: Path = DATA_DIR) -> None:
+        self.snapshot_path = data_dir / "state.snapshot"
+        self.journal_path = data_dir / "journal.jsonl"
+        self.requests_path = data_dir / "requests.json"
+        self.lock_path = data_dir / "journal.lock"
+        self.counter_path = data_dir / "counter.json"
+        self.counter_lock_path = data_dir / "counter.lock"
+        self.requests_lock_path = data_dir / "requests.lock"
+
+        self.counter = 1
+        self.requests: dict[int, tuple[int, int]] = {}
+        self.group_messages: dict[int, int] = {}
+        self.stats = RequestStats()
+        self.submissions = DedupeCache()
+
+        self._offset = 0
+        self._since_snapshot = 0
+
+    def load(self) -> None:
+        started = time.perf_counter()
+
+        snapshot_loaded = self._load_snapshot()
+        snapshot_done = time.perf_counter()
+
+        bootstrapped = 0
+        if not snapshot_loaded:
+            bootstrapped = self._bootstrap_from_requests()
+        bootstrap_done = time.perf_counter()
+
+        with file_lock(self.lock_path):
+            replayed = self._replay_journal()
+        replay_done = time.perf_counter()
+
+        if not snapshot_loaded or replayed:
+            with file_lock(self.lock_path):
+                self.save_snapshot()
+        snapshot_saved = time.perf_counter()
+
+        logger.info(
+            f"[store] startup: snapshot {'loaded' if snapshot_loaded else 'missing'} "
+            f"{(snapshot_done - started) * 1000:.1f} ms, "
+            f"bootstrap {bootstrapped} requests {(bootstrap_done - snapshot_done) * 1000:.1f} ms, "
+            f"journal replay {replayed} records {(replay_done - bootstrap_done) * 1000:.1f} ms, "
+            f"snapshot save {(snapshot_saved - replay_done) * 1000:.1f} ms, "
+            f"total {(snapshot_saved - started) * 1000:.1f} ms."
+        )
+
+    def _load_snapshot(self) -> bool:
+        try:
+            with self.snapshot_path.open("rb") as f:
+                header = f.read(len(SNAPSHOT_MAGIC) + 2)
+                if header[:len(SNAPSHOT_MAGIC)] != SNAPSHOT_MAGIC:
+                    logger.warning(f"[store] '{self.snapshot_path}' is not a snapshot, rebuilding state.")
+                    return False
+
+                version = int.from_bytes(header[len(SNAPSHOT_MAGIC):], "big")
+                if version != SNAPSHOT_VERSION:
+                    logger.warning(f"[store] snapshot version {version} is not supported, rebuilding state.")
+                    return False
+
+                state = json.loads(zlib.decompress(f.read()))
+        except FileNotFoundError:
+            return False
+        except Exception as e:
+            logger.warning(f"[store] could not read '{self.snapshot_path}' ({e}), rebuilding state.")
+            return False
+
+        try:
+            counter = state["counter"]
+            requests = {number: (user_id, status) for number, user_id, status in state["requests"]}
+            group_messages = {message_id: number for message_id, number in state["group_messages"]}
+            stats = RequestStats.from_state(state["stats"])
+            submissions = DedupeCache.from_state(state["submissions"])
+            offset = state["offset"]
+        except Exception as e:
+            logger.warning(f"[store] snapshot '{self.snapshot_path}' contains incorrect data ({e}), rebuilding state.")
+            return False
+
+        self.counter = counter
+        self.requests = requests
+        self.group_messages = group_messages
+        self.stats = stats
+        self.submissions = submissions
+        self._offset = offset
+        return True
+
+    def _bootstrap_from_requests(self) -> int:
+        """
+        One-time migration from requests.json when no snapshot exists yet.
+
+        Replies were not tracked before, so statistics start from the first
+        event written after the migration.
+        """
+        if not self.requests_path.exists():
+            return 0
+
+        try:
+            with self.requests_path.open("r", encoding="utf-8") as f:
+                data = json.load(f)
+        except (json.JSONDecodeError, OSError) as e:
+            logger.error(f"[store] error loading '{self.requests_path}' ({e}).")
+            return 0
+
+        if not isinstance(data, list):
+            logger.error(f"[store] '{self.requests_path}' contains incorrect data.")
+            return 0
+
+        count = 0
+        for record in data:
+            number = record.get("number", record.get("counter"))
+            if number is None:
+                continue
+            self._apply({"e": "request", "number": number, "user_id": record.get("user_id"), "status": record.get("status", 1)})
+            count += 1
+        return count
+
+    def _replay_journal(self) -> int:
+        try:
+            f = self.journal_path.open("rb")
+        except FileNotFoundError:
+            self._offset = 0
+            return 0
+
+        replayed = 0
+        with f:
+            f.seek(self._offset)
+            for line in f:
+                # Line torn by a crash mid-write; it is truncated below
+                if not line.endswith(b"\n"):
+                    break
+                try:
+                    self._apply(json.loads(line))
+                except (json.JSONDecodeError, KeyError, TypeError) as e:
+                    logger.warning(f"[store] skipped broken journal record at offset {self._offset} ({e}).")
+                self._offset += len(line)
+                replayed += 1
+
+        if self.journal_path.stat().st_size > self._offset:
+            with self.journal_path.open("r+b") as f:
+                f.truncate(self._offset)
+            logger.warning(f"[store] truncated incomplete journal record at offset {self._offset}.")
+
+        return replayed
+
+    def _apply(self, event: dict[str, Any]) -> None:
+        kind = event["e"]
+        if kind == "request":
+            number = event["number"]
+            self.requests[number] = (event["user_id"], event["status"])
+            self.counter = max(self.counter, number + 1)
+            if "address" in event:
+                self.stats.on_request(number, event["address"], event["ts"])
+            if event.get("key"):
+                self.submissions.put(event["key"], number, event["ts"])
+        elif kind == "group_message":
+            self.group_messages[event["message_id"]] = event["number"]
+        elif kind == "reply":
+            self.stats.on_reply(event["number"], event["ts"])
+        else:
+            logger.warning(f"[store] unknown journal event '{kind}'.")
+
+    def _load_counter(self) -> int:
+        try:
+            with self.counter_path.open("r", encoding="utf-8") as f:
+                data = json.load(f)
+                return data.get("counter", 1)
+        except FileNotFoundError:
+            initial = int(os.getenv("INITIAL_COUNTER_VALUE", "1"))
+            logger.info(f"[counter] counter.json was not found, used counter value from the environment: {initial}")
+            return initial
+        except json.JSONDecodeError:
+            logger.warning("[counter] reading error counter.json, counter value reset to 1")
+            return 1
+
+    def _save_counter(self, counter: int) -> None:
+        self.counter_path.parent.mkdir(parents=True, exist_ok=True)
+        with self.counter_path.open("w", encoding="utf-8") as f:
+            json.dump({"counter": counter}, f, ensure_ascii=False)
+        logger.info(f"[counter] counter value saved: {counter}")
+
+    def allocate_counter(self) -> int:
+        """
+        Allocate the next request number under an inter-process lock, so several
+        instances sharing the data directory never hand out the same number.
+        """
+        with file_lock(self.counter_lock_path):
+            self.refresh()
+            counter = max(self._load_counter(), self.counter)
+            self._save_counter(counter + 1)
+            return counter
+
+    def save_request(self, new_request: dict) -> None:
+        """
+        Append a request to requests.json with an atomic rewrite of the file.
+
+        The read-modify-write runs under an inter-process lock, so instances
+        sharing the data directory do not lose each other's requests.
+
+        Args:
+            new_request: Request data, containing:
+                - timestamp: ISO creation time
+                - number: Unique request number
+                - user: Username or full name
+                - user_id: Telegram user ID
+                - address: Address of the request
+                - text: Request text
+                - phone: Contact details
+                - files: File IDs (if any)
+                - file_types: File types (if any)
+                - status: Request status ("open" by default)
+        """
+        if "status" not in new_request:
+            new_request["status"] = "open"
+
+        self.requests_path.parent.mkdir(parents=True, exist_ok=True)
+        with file_lock(self.requests_lock_path):
+            try:
+                if self.requests_path.exists():
+                    with self.requests_path.open("r", encoding="utf-8") as f:
+                        data = json.load(f)
+                else:
+                    data = []
+
+                data.append(new_request)
+
+                with tempfile.NamedTemporaryFile(
+                    "w", delete=False, dir=self.requests_path.parent, encoding="utf-8", suffix=".tmp"
+                ) as tf:
+                    json.dump(data, tf, ensure_ascii=False, indent=2)
+                    temp_path = Path(tf.name)
+                temp_path.replace(self.requests_path)
+            except (OSError, json.JSONDecodeError) as e:
+                logger.error(f"[store] failed to save request #{new_request.get('number')} ({e}).")
+                if 'temp_path' in locals() and temp_path.exists():
+                    temp_path.unlink(missing_ok=True)
+                raise
+
+        logger.info(f"[store] request #{new_request.get('number')} saved to {self.requests_path.name}.")
+
+    def refresh(self) -> int:
+        """Replay journal records written by other processes since the last read."""
+        with file_lock(self.lock_path):
+            return self._replay_journal()
+
+    def _append(self, event: dict[str, Any]) -> None:
+        with file_lock(self.lock_path):
+            self._replay_journal()
+            self._apply(event)
+
+            self.journal_path.parent.mkdir(parents=True, exist_ok=True)
+            with self.journal_path.open("ab") as f:
+                f.write(json.dumps(event, ensure_ascii=False, separators=(",", ":")).encode("utf-8") + b"\n")
+                f.flush()
+                os.fsync(f.fileno())
+                self._offset = f.tell()
+
+            self._since_snapshot += 1
+            if self._since_snapshot >= SNAPSHOT_EVERY:
+                self.save_snapshot()
+
+    def save_snapshot(self) -> None:
+        state = {
+            "counter": self.counter,
+            "requests": [[number, user_id, status] for number, (user_id, status) in self.requests.items()],
+            "group_messages": list(self.group_messages.items()),
+            "stats": self.stats.to_state(),
+            "submissions": self.submissions.to_state(),
+            "offset": self._offset
+        }
+        payload = zlib.compress(json.dumps(state, ensure_ascii=False, separators=(",", ":")).encode("utf-8"))
+
+        try:
+            self.snapshot_path.parent.mkdir(parents=True, exist_ok=True)
+            with tempfile.NamedTemporaryFile("wb", delete=False, dir=self.snapshot_path.parent, suffix=".tmp") as tf:
+                tf.write(SNAPSHOT_MAGIC + SNAPSHOT_VERSION.to_bytes(2, "big") + payload)
+                temp_path = Path(tf.name)
+            temp_path.replace(self.snapshot_path)
+            self._since_snapshot = 0
+        except OSError as e:
+            logger.error(f"[store] failed to save snapshot ({e}).")
+            if 'temp_path' in locals() and temp_path.exists():
+                temp_path.unlink(missing_ok=True)
+
+    def claim_submission(self, key: str) -> int | None:
+        """
+        Reserve a draft key for submission.
+
+        Returns None if the key is new and is now reserved, otherwise the number
+        of the request already registered for it (PENDING while in progress).
+        """
+        number = self.submissions.get(key)
+        if number is None:
+            self.submissions.put(key, PENDING, time.time())
+        return number
+
+    def release_submission(self, key: str) -> None:
+        if self.submissions.get(key) == PENDING:
+            self.submissions.discard(key)
+
+    def record_request(self, number: int, user_id: int, address: str, status: int = 1, key: str | None = None) -> None:
+        event = {"e": "request", "number": number, "user_id": user_id, "address": address, "status": status, "ts": time.time()}
+        if key:
+            event["key"] = key
+        self._append(event)
+
+    def record_reply(self, number: int) -> None:
+        self._append({"e": "reply", "number": number, "ts": time.time()})
+
+    def record_group_message(self, message_id: int, number: int) -> None:
+        self._append({"e": "group_message", "message_id": message_id, "number": number})
+
+    def get_user_id(self, number: int) -> int | None:
+        entry = self.requests.get(number)
+        return entry[0] if entry else None
+
+    def get_request_number(self, message_id: int) -> int | None:
+        return self.group_messages.get(message_id)
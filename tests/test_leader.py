@@ -0,0 +1,45 @@
+import multiprocessing
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from storage import wait_for_leadership, release_leadership
+
+
+def _leader(path: str, acquired, release) -> None:
+    lock = wait_for_leadership(Path(path))
+    acquired.set()
+    release.wait(timeout=30)
+    release_leadership(lock)
+    # Keep the process alive, the handover must not depend on its exit
+    time.sleep(5)
+
+
+def _standby(path: str, acquired) -> None:
+    lock = wait_for_leadership(Path(path))
+    acquired.set()
+    release_leadership(lock)
+
+
+def test_standby_takes_over_when_leader_releases(tmp_path):
+    ctx = multiprocessing.get_context("fork")
+    path = str(tmp_path / "leader.lock")
+    leader_acquired, release, standby_acquired = ctx.Event(), ctx.Event(), ctx.Event()
+
+    leader = ctx.Process(target=_leader, args=(path, leader_acquired, release))
+    leader.start()
+    assert leader_acquired.wait(timeout=10)
+
+    standby = ctx.Process(target=_standby, args=(path, standby_acquired))
+    standby.start()
+    assert not standby_acquired.wait(timeout=1)
+
+    release.set()
+    assert standby_acquired.wait(timeout=5)
+
+    standby.join(timeout=10)
+    assert standby.exitcode == 0
+    leader.terminate()
+    leader.join(timeout=10)
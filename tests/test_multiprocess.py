@@ -0,0 +1,48 @@
+import json
+import multiprocessing
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from storage import RequestStore
+
+
+WORKERS = 6
+REQUESTS_PER_WORKER = 50
+
+
+def _worker(data_dir: str, count: int) -> None:
+    store = RequestStore(Path(data_dir))
+    store.load()
+    for _ in range(count):
+        number = store.allocate_counter()
+        store.save_request({"number": number, "user_id": 1, "address": "Складской проезд, 4", "status": 1})
+        store.record_request(number, 1, "Складской проезд, 4")
+
+
+def test_parallel_instances_allocate_unique_numbers(tmp_path):
+    ctx = multiprocessing.get_context("fork")
+    processes = [ctx.Process(target=_worker, args=(str(tmp_path), REQUESTS_PER_WORKER)) for _ in range(WORKERS)]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join(timeout=60)
+        assert process.exitcode == 0
+
+    with (tmp_path / "journal.jsonl").open("r", encoding="utf-8") as f:
+        numbers = [json.loads(line)["number"] for line in f]
+
+    total = WORKERS * REQUESTS_PER_WORKER
+    assert len(numbers) == total
+    assert len(set(numbers)) == total
+
+    with (tmp_path / "requests.json").open("r", encoding="utf-8") as f:
+        saved = [request["number"] for request in json.load(f)]
+    assert len(saved) == total
+    assert set(saved) == set(numbers)
+
+    store = RequestStore(tmp_path)
+    store.load()
+    assert len(store.requests) == total
+    assert store.counter == max(numbers) + 1
@@ -0,0 +1,37 @@
+import sys
+from datetime import date
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from storage import RequestStore
+
+
+def test_snapshot_restores_state(tmp_path):
+    store = RequestStore(tmp_path)
+    store.load()
+    store.record_request(1, 10, "Складской проезд, 4", key="draft")
+    store.record_request(2, 11, "Полтавская улица, 5")
+    store.record_group_message(100, 1)
+    store.record_reply(1)
+    store.save_snapshot()
+
+    restored = RequestStore(tmp_path)
+    restored.load()
+    assert restored.counter == 3
+    assert restored.requests == store.requests
+    assert restored.group_messages == store.group_messages
+    assert restored.submissions.get("draft") == 1
+    assert restored.stats.summary(date.today()) == store.stats.summary(date.today())
+
+
+def test_broken_snapshot_is_rebuilt_from_journal(tmp_path):
+    store = RequestStore(tmp_path)
+    store.load()
+    store.record_request(1, 10, "Складской проезд, 4")
+    store.snapshot_path.write_bytes(b"\x80\x04garbage")
+
+    restored = RequestStore(tmp_path)
+    restored.load()
+    assert restored.get_user_id(1) == 10
+    assert restored.counter == 2